@@ -3,19 +3,27 @@
 -h, --help: подсказка с описанием аргументов запуска
 -с, --clear:  флаг предварительной очистки таблицы БД;
 -w, --winner: флаг для записи только победителей GGA;
--y, --year: год проведения церемонии GGA в формате YYYY
+-y, --year: год проведения церемонии GGA в формате YYYY;
+-s, --chunksize: размер фрагмента чтения в строках (по умолчанию 20000);
+-u, --unsafe: флаг ускоренной записи без гарантий сохранности БД при сбое
 
 Пример: python main.py -с --year 1995 -w
 
-Для чтения и подготовки данных применена pandas, хотя возможны варианты
-без сторонних библиотек и модулей (csv, например).
+Для чтения и подготовки данных применен модуль csv стандартной библиотеки:
+строки разбираются сразу в кортежи для записи, без промежуточных датафреймов.
 Для случае работы с большим исходным файлом предусмотрено чтение частями:
 разбиение проводится по указанному количеству строк.
 
 Исключение вставки дубликатов реализовано через ограничение таблицы
-по уникальности с условием ON CONFLICT IGNORE: исходная запись не затрагивается,
-дубликаты игнорируются. Для корректной работы UNIQUE CONSTRAINT значение null
-заменены на 0.
+по уникальности с условием ON CONFLICT IGNORE (и INSERT OR IGNORE в запросе
+записи): исходная запись не затрагивается, дубликаты игнорируются.
+Для корректной работы UNIQUE CONSTRAINT значение null заменены на 0.
+
+Очистка таблицы и запись всех фрагментов выполняются в одной транзакции:
+фиксация проводится один раз по окончании чтения, при ошибке изменения
+откатываются.
+На время работы скрипта БД блокируется монопольно (locking_mode=EXCLUSIVE):
+другие процессы не могут читать ее до завершения записи.
 
 Некоторые пути улучшения и моменты, связанные с бизнес-процессами:
 1. Обрабатывать ошибки БД (к примеру, ошибка подключения) при выполнении
@@ -28,14 +36,31 @@
 3. Избавиться от "хардкора" в коде: задавать путь в параметрах запуска и т.п.
 """
 
+import os
 import sys
+import csv
 import warnings
+import itertools
 import sqlite3
-import pandas as pd
 import sqlite3 as db
 import logging
 import argparse
 
+
+def positive_int(value):
+    """
+    Тип аргумента: целое число не меньше 1
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            f"ожидается целое число больше 0: {value!r}")
+    return number
+
+
 parser = argparse.ArgumentParser()
 parser.add_argument('-c', '--clear', action='store_const', const=True,
                     help='Флаг предварительной очистки таблицы БД')
@@ -43,6 +68,11 @@ parser.add_argument('-w', '--winner', action='store_const', const=True,
                     help='Флаг для записи только победителей GGA')
 parser.add_argument('-y', '--year', default=None,
                     help='Год проведения церемонии GGA')
+parser.add_argument('-s', '--chunksize', type=positive_int, default=20000,
+                    help='Размер фрагмента чтения, строк (по умолчанию 20000)')
+parser.add_argument('-u', '--unsafe', action='store_const', const=True,
+                    help='Ускоренная запись без гарантий сохранности БД '
+                         'при сбое (synchronous=OFF, journal_mode=MEMORY)')
 args = parser.parse_args()
 year = int(args.year) if args.year else None
 sys.tracebacklimit = -1
@@ -54,20 +84,78 @@ logging.basicConfig(level=logging.INFO,
                     datefmt='%d/%m/%Y %I:%M:%S')
 
 
+# Столбцы таблицы gg_awards в порядке значений в кортежах строк
+COLUMNS = ("year_film", "year_award", "ceremony", "category", "nominee",
+           "film", "win")
+
+# Настройки соединения для пакетной записи: монопольная блокировка файла
+# на все время работы (задается до выбора журнала, чтобы WAL
+# не использовал разделяемую память -shm), кэш страниц 64 МБ
+PRAGMAS = (
+    "PRAGMA locking_mode=EXCLUSIVE",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+)
+# Журнал по умолчанию: WAL вместо журнала отката, fsync только
+# на контрольных точках. Автоматические контрольные точки отключены:
+# WAL переносится в БД один раз после записи (DB.checkpoint)
+JOURNAL_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA wal_autocheckpoint=0",
+    "PRAGMA synchronous=NORMAL",
+)
+# Журнал в режиме --unsafe: сбой во время записи может повредить БД
+UNSAFE_JOURNAL_PRAGMAS = (
+    "PRAGMA journal_mode=MEMORY",
+    "PRAGMA synchronous=OFF",
+)
+
+
 class DBConnection:
     """
-    Дескриптор атрибута conn - строки подключения к БД
+    Дескриптор атрибута conn - подключения к БД.
+    Атрибуту присваивается строка подключения или пара (строка
+    подключения, параметры connect); соединение открывается
+    при первом обращении и хранится в экземпляре владельца
     """
+    def __set_name__(self, owner, name):
+        self.uri_name = f"_{name}_uri"
+        self.conn_name = f"_{name}"
+
     def __get__(self, obj, objtype=None):
-        return self.conn
+        if obj is None:
+            return self
+        conn = obj.__dict__.get(self.conn_name)
+        if conn is None:
+            uri, options = obj.__dict__[self.uri_name]
+            conn = self.connect(uri, **options)
+            obj.__dict__[self.conn_name] = conn
+        return conn
+
+    def __set__(self, obj, value):
+        if isinstance(value, tuple):
+            uri, options = value
+        else:
+            uri, options = value, {}
+        obj.__dict__[self.uri_name] = (uri, options)
+        conn = obj.__dict__.pop(self.conn_name, None)
+        if conn is not None:
+            conn.close()
 
-    def __set__(self, obj, conn):
+    @staticmethod
+    def connect(uri, unsafe=False):
         try:
-            conn = db.connect(conn, uri=True)
+            # Транзакциями управляет DB (begin/commit/rollback),
+            # неявное открытие транзакций модулем sqlite3 отключено
+            conn = db.connect(uri, uri=True, isolation_level=None)
+            journal = UNSAFE_JOURNAL_PRAGMAS if unsafe else JOURNAL_PRAGMAS
+            for pragma in PRAGMAS + journal:
+                conn.execute(pragma)
         except db.DatabaseError:
             logging.error("Ошибка подключения к базе данных")
             raise
-        self.conn = conn
+        return conn
 
 
 def db_validator(f):
@@ -78,7 +166,7 @@ def db_validator(f):
             logging.error(f"====== Ошибка базы данных: {e}")
             raise
         else:
-            logging.info("====== Работа с фрагментом завершена")
+            logging.debug("====== Работа с фрагментом завершена")
     return wrapper
 
 
@@ -88,55 +176,168 @@ class DB:
     """
     conn = DBConnection()
 
-    def __init__(self, conn):
-        self.conn = conn
+    def __init__(self, conn, unsafe=False):
+        self.conn = conn, {"unsafe": unsafe}
+        self._cursor_obj = None
+        self._insert_sql = self._build_insert_sql(COLUMNS)
+        # Статистика записи: итог выводится одной строкой по окончании
+        self.chunks_written = 0
+        self.rows_written = 0
+
+    @property
+    def _cursor(self):
+        # Один курсор на все запросы вместо нового курсора на каждый вызов;
+        # после переоткрытия соединения курсор создается заново
+        conn = self.conn
+        if self._cursor_obj is None or self._cursor_obj.connection is not conn:
+            self._cursor_obj = conn.cursor()
+        return self._cursor_obj
+
+    @staticmethod
+    def _build_insert_sql(columns):
+        """
+        Текст запроса вставки строится один раз: один и тот же объект
+        строки при каждом вызове находится в кэше подготовленных
+        выражений sqlite3 без повторного разбора
+        """
+        cols = list(columns)
+        return (f"INSERT OR IGNORE INTO gg_awards ({', '.join(cols)}) "
+                f"VALUES ({', '.join('?' * len(cols))})")
+
+    def begin(self):
+        self._cursor.execute("BEGIN")
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def checkpoint(self):
+        self._cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
 
     @db_validator
-    def write_data(self, df_chunk, year_award=None, winners_only=False):
-        with self.conn:
-            if winners_only:
-                df_chunk = df_chunk[df_chunk["win"]]
-            if year_award:
-                df_chunk = df_chunk[df_chunk["year_award"] == year_award]
-            if not df_chunk.empty:
-
-                # Значения null заменяем на 0 для корректной работы constraint
-                df_chunk.fillna(0, inplace=True)
-                print(df_chunk)
-                df_chunk.to_sql(
-                    name="gg_awards",
-                    con=self.conn,
-                    if_exists="append",
-                    index=False
-                )
-                logging.info("====== Запись фрагмента проведена успешно")
-            else:
-                logging.info("====== Фрагмент не содержит данных")
+    def write_data(self, rows):
+        """
+        Запись фрагмента - списка кортежей строк в порядке COLUMNS.
+        Фиксация транзакции выполняется вызывающей стороной
+        (см. begin/commit)
+        """
+        self.chunks_written += 1
+        if rows:
+            logging.debug("====== Фрагмент: строк %d", len(rows))
+            self._cursor.executemany(self._insert_sql, rows)
+            self.rows_written += self._cursor.rowcount
+            logging.debug("====== Запись фрагмента проведена успешно")
+        else:
+            logging.debug("====== Фрагмент не содержит данных")
 
     def clear_all(self):
-        with self.conn:
-            cursor = self.conn.cursor()
-            del_query = "DELETE from gg_awards"
-            cursor.execute(del_query)
+        """
+        Очистка таблицы в рамках текущей транзакции: при ошибке
+        последующей записи удаленные строки восстанавливаются откатом.
+        DELETE без WHERE SQLite выполняет как очистку страниц таблицы
+        (truncate optimization), а не построчное удаление
+        """
+        self._cursor.execute("DELETE from gg_awards")
         logging.info("====== Все записи таблицы успешно удалены")
 
 
+def null_to_zero(value):
+    """
+    Конвертер текстовых полей: значения null заменяем на 0
+    для корректной работы constraint
+    """
+    return value if value else "0"
+
+
+def parse_int(value):
+    """
+    Конвертер целочисленных полей: значения null заменяем на 0
+    для корректной работы constraint
+    """
+    return int(value) if value else 0
+
+
+# Допустимые значения логических полей; null заменяем на 0 (False)
+BOOL_VALUES = {"True": True, "1": True, "False": False, "0": False,
+               "": False}
+
+
+def parse_bool(value):
+    """
+    Конвертер логических полей: строка файла сразу приводится к bool,
+    отбор победителей проверяет готовое значение
+    """
+    try:
+        return BOOL_VALUES[value]
+    except KeyError:
+        raise ValueError(
+            f"Некорректное логическое значение: {value!r}") from None
+
+
 class Reader:
     """
     Класс для работы с источником данных.
     Чтение файла частями (chunky)
     """
+    # Схема файла известна заранее: конвертеры значений по столбцам.
+    # Пустые значения заполняются при разборе
+    CONVERTERS = {
+        "year_film": parse_int,
+        "year_award": parse_int,
+        "ceremony": parse_int,
+        "category": null_to_zero,
+        "nominee": null_to_zero,
+        "film": null_to_zero,
+        "win": parse_bool,
+    }
+
     def __init__(self, filepath):
         self.filepath = filepath
 
-    def get_data_chunk(self, size):
+    def get_data_chunk(self, size, year_award=None, winners_only=False):
+        """
+        Генератор фрагментов - списков кортежей строк в порядке COLUMNS.
+        Размер фрагмента задается количеством строк.
+        Отбор по году и победителям выполняется за тот же проход,
+        что и разбор строк, до конвертации отбрасываемых строк
         """
-        Генератор датафрейм-фрагментов.
-        Размер фрагмента задается количеством строк
+        with open(self.filepath, newline="", encoding="utf-8") as f:
+            self._advise_sequential(f.fileno())
+            r = csv.reader(f)
+            header = next(r)
+            fields = [(header.index(col), self.CONVERTERS[col])
+                      for col in COLUMNS]
+            while True:
+                lines = list(itertools.islice(r, size))
+                if not lines:
+                    break
+                yield list(self._rows(lines, fields, year_award,
+                                      winners_only))
+
+    @staticmethod
+    def _advise_sequential(fd):
         """
-        with pd.read_csv(self.filepath, chunksize=size) as r:
-            for chunk in r:
-                yield chunk
+        Подсказка ОС о последовательном чтении файла целиком:
+        расширенное упреждающее чтение в кэш страниц (только POSIX)
+        """
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+
+    @staticmethod
+    def _rows(lines, fields, year_award, winners_only):
+        # Условия отбора проверяются по исходным полям строки до разбора
+        # остальных: отбрасываемые строки не конвертируются целиком
+        win_i, win_conv = fields[COLUMNS.index("win")]
+        year_i, year_conv = fields[COLUMNS.index("year_award")]
+        for line in lines:
+            if winners_only and not win_conv(line[win_i]):
+                continue
+            if year_award and year_conv(line[year_i]) != year_award:
+                continue
+            yield tuple(conv(line[i]) for i, conv in fields)
 
 
 if __name__ == "__main__":
@@ -144,10 +345,25 @@ if __name__ == "__main__":
     path_to_file = "golden_globe_awards.csv"
     db_conn = "file:golden_globe_awards.db?mode=rw"
 
-    gga_db = DB(db_conn)
+    gga_db = DB(db_conn, unsafe=args.unsafe)
     reader = Reader(path_to_file)
 
-    if args.clear:
-        gga_db.clear_all()
-    for ch in reader.get_data_chunk(size=1000):
-        gga_db.write_data(ch, year_award=year, winners_only=args.winner)
+    # Очистка и запись всех фрагментов выполняются в одной транзакции:
+    # одна фиксация (fsync) на весь процесс вместо фиксации после
+    # каждого фрагмента
+    gga_db.begin()
+    try:
+        if args.clear:
+            gga_db.clear_all()
+        for ch in reader.get_data_chunk(size=args.chunksize,
+                                        year_award=year,
+                                        winners_only=args.winner):
+            gga_db.write_data(ch)
+    except Exception:
+        gga_db.rollback()
+        logging.error("====== Запись прервана, изменения отменены")
+        raise
+    gga_db.commit()
+    gga_db.checkpoint()
+    logging.info(f"====== Запись завершена: фрагментов "
+                 f"{gga_db.chunks_written}, новых строк {gga_db.rows_written}")